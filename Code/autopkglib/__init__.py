@@ -15,19 +15,20 @@
 # limitations under the License.
 
 """Core/shared autopkglib functions"""
-import glob
 import imp
 import json
 import os
 import plistlib
 import pprint
 import re
+import stat
 import subprocess
 import sys
 import traceback
 from copy import deepcopy
-from distutils.version import LooseVersion
-from typing import IO, Any, Dict, List, Optional, Union
+from functools import lru_cache
+from typing import IO, Any, Dict, List, Optional, Tuple, Union
+from xml.etree import ElementTree
 
 import appdirs
 import pkg_resources
@@ -42,19 +43,26 @@ FileOrPath = Union[IO, str, bytes, int]
 VarDict = Dict[str, Any]
 
 
+# The platform can't change while we're running, so only inspect it once.
+_PLATFORM = sys.platform.lower()
+IS_MAC = "darwin" in _PLATFORM
+IS_WINDOWS = "win32" in _PLATFORM
+IS_LINUX = "linux" in _PLATFORM
+
+
 def is_mac():
     """Return True if current OS is macOS."""
-    return "darwin" in sys.platform.lower()
+    return IS_MAC
 
 
 def is_windows():
     """Return True if current OS is Windows."""
-    return "win32" in sys.platform.lower()
+    return IS_WINDOWS
 
 
 def is_linux():
     """Return True if current OS is Linux."""
-    return "linux" in sys.platform.lower()
+    return IS_LINUX
 
 
 def log(msg, error=False):
@@ -70,20 +78,20 @@ def log_err(msg):
     log(msg, error=True)
 
 
-try:
-    from CoreFoundation import (
-        CFPreferencesAppSynchronize,
-        CFPreferencesCopyAppValue,
-        CFPreferencesCopyKeyList,
-        CFPreferencesSetAppValue,
-        kCFPreferencesAnyHost,
-        kCFPreferencesAnyUser,
-        kCFPreferencesCurrentHost,
-        kCFPreferencesCurrentUser,
-    )
-    from Foundation import NSArray, NSDictionary, NSNumber
-except ImportError:
-    if is_mac():
+if IS_MAC:
+    try:
+        from CoreFoundation import (
+            CFPreferencesAppSynchronize,
+            CFPreferencesCopyAppValue,
+            CFPreferencesCopyKeyList,
+            CFPreferencesSetAppValue,
+            kCFPreferencesAnyHost,
+            kCFPreferencesAnyUser,
+            kCFPreferencesCurrentHost,
+            kCFPreferencesCurrentUser,
+        )
+        from Foundation import NSArray, NSDictionary, NSNumber
+    except ImportError:
         print(
             "ERROR: Failed 'from Foundation import NSArray, NSDictionary' in "
             + __name__
@@ -93,7 +101,9 @@ except ImportError:
             "CFPreferencesAppSynchronize, ...' in " + __name__
         )
         raise
-    # On non-macOS platforms, the above imported names are stubbed out.
+else:
+    # On non-macOS platforms, don't try to load PyObjC at all; the names it
+    # would provide are stubbed out.
     NSArray = list
     NSDictionary = dict
     NSNumber = int
@@ -115,10 +125,71 @@ except ImportError:
     kCFPreferencesCurrentUser = None
     kCFPreferencesCurrentHost = None
 
+
+def _json_dumps(obj: Any) -> bytes:
+    """Serialize obj to indented JSON with sorted keys."""
+    return json.dumps(
+        obj, skipkeys=True, ensure_ascii=True, indent=2, sort_keys=True
+    ).encode("utf-8")
+
+
+try:
+    # orjson is a much faster drop-in for reading JSON preferences, but it isn't
+    # required; fall back to the standard library without it. Writes always use
+    # the json module so the file layout doesn't depend on what is installed.
+    import orjson
+
+    # orjson reads integers wider than 64 bits as floats, where json keeps them
+    # exact, so leave any long run of digits to the json module.
+    _LONG_DIGITS = re.compile(rb"\d{19}")
+
+    def _json_loads(data: bytes) -> Any:
+        """Deserialize JSON data."""
+        if not _LONG_DIGITS.search(data):
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                # A byte-order mark, NaN or Infinity; json accepts those.
+                pass
+        return json.loads(data)
+
+except ImportError:
+
+    def _json_loads(data: bytes) -> Any:
+        """Deserialize JSON data."""
+        return json.loads(data)
+
+
+try:
+    # Recipes are plain data, so the libyaml-backed safe loader is enough and is
+    # much faster than the pure-Python loaders.
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+try:
+    # lxml builds the XML tree in C, which makes reading plist recipes much
+    # faster than plistlib's Python-level expat handlers. It isn't required.
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
 APP_NAME = "Autopkg"
 BUNDLE_ID = "com.github.autopkg"
 
-RE_KEYREF = re.compile(r"%(?P<key>[a-zA-Z_][a-zA-Z_0-9]*)%")
+# Config files used for preferences on platforms other than macOS, in the order
+# they are tried. The location is fixed for the life of the process.
+CONFIG_DIR = appdirs.user_config_dir(APP_NAME, appauthor=False)
+CONFIG_FILES = (
+    os.path.join(CONFIG_DIR, "config.plist"),
+    os.path.join(CONFIG_DIR, "config.json"),
+)
+
+RE_KEYREF = re.compile(r"%([a-zA-Z_][a-zA-Z_0-9]*)%")
+
+# Version components as split by distutils.version.LooseVersion
+RE_VERSION_COMPONENT = re.compile(r"(\d+ | [a-z]+ | \.)", re.VERBOSE)
 
 # Supported recipe extensions
 RECIPE_EXTS = (".recipe", ".recipe.plist", ".recipe.yaml")
@@ -141,7 +212,7 @@ class Preferences:
         # Path to the preferences file we were given
         self.file_path: Optional[str] = None
         # If we're on macOS, read in the preference domain first.
-        if is_mac():
+        if IS_MAC:
             self.prefs = self._get_macos_prefs()
         else:
             self.prefs = self._get_file_prefs()
@@ -149,41 +220,47 @@ class Preferences:
             log_err("WARNING: Did not load any default preferences.")
 
     def _parse_json_or_plist_file(self, file_path):
-        """Parse the file. Start with plist, then JSON."""
+        """Parse the file. Start with plist, then JSON, unless the contents
+        look like JSON."""
         try:
             with open(file_path, "rb") as f:
-                data = plistlib.load(f)
-            self.type = "plist"
+                raw = f.read()
+        except Exception:
+            return {}
+        parsers = [("plist", plistlib.loads), ("json", _json_loads)]
+        if raw.lstrip()[:1] in (b"{", b"["):
+            # Don't bother trying to parse an obviously JSON file as a plist
+            parsers.reverse()
+        for file_type, parser in parsers:
+            try:
+                data = parser(raw)
+            except Exception:
+                continue
+            self.type = file_type
             self.file_path = file_path
             return data
-        except Exception:
-            pass
-        try:
-            with open(file_path, "rb") as f:
-                data = json.load(f)
-                self.type = "json"
-                self.file_path = file_path
-                return data
-        except Exception:
-            pass
         return {}
 
     def __deepconvert_objc(self, object):
         """Convert all contents of an ObjC object to Python primitives."""
-        value = object
-        if isinstance(object, NSNumber):
-            value = int(object)
-        elif isinstance(object, NSArray) or isinstance(object, list):
-            value = [self.__deepconvert_objc(x) for x in object]
-        elif isinstance(object, NSDictionary):
-            value = dict(object)
-            # RECIPE_REPOS is a dict of dicts
-            for k, v in value.items():
-                if isinstance(v, NSDictionary):
-                    value[k] = dict(v)
-        else:
-            return object
-        return value
+        root = [object]
+        stack = [(root, 0)]
+        while stack:
+            container, key = stack.pop()
+            value = container[key]
+            # RECIPE_REPOS is a dict of dicts, so check for those first
+            if isinstance(value, (dict, NSDictionary)):
+                value = dict(value)
+                stack.extend((value, k) for k in value)
+            elif isinstance(value, (list, NSArray)):
+                value = list(value)
+                stack.extend((value, index) for index in range(len(value)))
+            elif isinstance(value, NSNumber):
+                value = int(value)
+            else:
+                continue
+            container[key] = value
+        return root[0]
 
     def _get_macos_pref(self, key):
         """Get a specific macOS preference key."""
@@ -193,8 +270,6 @@ class Preferences:
     def _get_macos_prefs(self):
         """Return a dict (or an empty dict) with the contents of all
         preferences in the domain."""
-        prefs = {}
-
         # get keys stored via 'defaults write [domain]'
         user_keylist = CFPreferencesCopyKeyList(
             BUNDLE_ID, kCFPreferencesCurrentUser, kCFPreferencesAnyHost
@@ -207,12 +282,12 @@ class Preferences:
 
         # CFPreferencesCopyAppValue() in get_macos_pref() will handle returning the
         # appropriate value using the search order, so merging prefs in order
-        # here isn't necessary
-        for keylist in [system_keylist, user_keylist]:
-            if keylist:
-                for key in keylist:
-                    prefs[key] = self._get_macos_pref(key)
-        return prefs
+        # here isn't necessary. That also means a key set in both domains only
+        # needs to be looked up once.
+        # (CFPreferencesCopyMultiple() can't be used instead, as it only reads a
+        # single domain and would skip the search order, including managed prefs.)
+        keys = dict.fromkeys([*(system_keylist or []), *(user_keylist or [])])
+        return {key: self._get_macos_pref(key) for key in keys}
 
     def _get_file_prefs(self):
         r"""Lookup preferences for Windows in a standardized path, such as:
@@ -220,15 +295,13 @@ class Preferences:
         * `/home/username/.config/Autopkg/config.{plist,json}`
         Tries to find `config.plist`, then `config.json`."""
 
-        config_dir = appdirs.user_config_dir(APP_NAME, appauthor=False)
-
         # Try a plist config, then a json config.
-        data = self._parse_json_or_plist_file(os.path.join(config_dir, "config.plist"))
-        if data:
-            return data
-        data = self._parse_json_or_plist_file(os.path.join(config_dir, "config.json"))
-        if data:
-            return data
+        for config_file in CONFIG_FILES:
+            if not os.path.exists(config_file):
+                continue
+            data = self._parse_json_or_plist_file(config_file)
+            if data:
+                return data
 
         return {}
 
@@ -245,22 +318,14 @@ class Preferences:
         """Read in a file and add the key/value pairs into preferences."""
         # Determine type or file: plist or json
         data = self._parse_json_or_plist_file(file_path)
-        for k in data:
-            self.prefs[k] = data[k]
+        self.prefs.update(data)
 
     def _write_json_file(self):
         """Write out the prefs into JSON."""
         try:
             assert self.file_path is not None
-            with open(self.file_path, "w") as f:
-                json.dump(
-                    self.prefs,
-                    f,
-                    skipkeys=True,
-                    ensure_ascii=True,
-                    indent=2,
-                    sort_keys=True,
-                )
+            with open(self.file_path, "wb") as f:
+                f.write(_json_dumps(self.prefs))
         except Exception as e:
             log_err(f"Unable to write out JSON: {e}")
 
@@ -285,7 +350,11 @@ class Preferences:
 
     def get_pref(self, key):
         """Retrieve a preference value."""
-        return deepcopy(self.prefs.get(key))
+        value = self.prefs.get(key)
+        if value is None or isinstance(value, (str, int, float, bool, bytes)):
+            # Immutable values can be handed out as-is
+            return value
+        return deepcopy(value)
 
     def get_all_prefs(self):
         """Retrieve a dict of all preferences."""
@@ -295,7 +364,7 @@ class Preferences:
         """Set a preference value."""
         self.prefs[key] = value
         # On macOS, write it back to preferences domain if we didn't use a file
-        if is_mac() and self.type is None:
+        if IS_MAC and self.type is None:
             self._set_macos_pref(key, value)
         elif self.file_path is not None:
             self.write_file()
@@ -327,38 +396,127 @@ def remove_recipe_extension(name):
     """Removes supported recipe extensions from a filename or path.
     If the filename or path does not end with any known recipe extension,
     the name is returned as is."""
-    for ext in RECIPE_EXTS:
-        if name.endswith(ext):
-            return name[: -len(ext)]
-    return name
-
+    if not name.endswith(RECIPE_EXTS):
+        return name
+    # Every recipe extension starts with ".recipe", and none of them is a
+    # suffix of another, so the extension starts at the last ".recipe".
+    return name[: name.rindex(".recipe")]
+
+
+def _plist_text(element):
+    """Return the text of a plist <key>, <string> or number element. Comments
+    and entity references split the text into several nodes; leave those to
+    plistlib."""
+    if len(element):
+        raise ValueError(f"unexpected children in <{element.tag}>")
+    return element.text or ""
+
+
+def _plist_dict(element):
+    """Convert a plist <dict> element."""
+    children = [child for child in element if isinstance(child.tag, str)]
+    keys = children[::2]
+    values = children[1::2]
+    if len(keys) != len(values):
+        raise ValueError("missing value for key in <dict>")
+    result = {}
+    for key, value in zip(keys, values):
+        if key.tag != "key" or value.tag == "key":
+            raise ValueError("unexpected element in <dict>")
+        result[_plist_text(key)] = _plist_value(value)
+    return result
+
+
+def _plist_array(element):
+    """Convert a plist <array> element."""
+    return [_plist_value(child) for child in element if isinstance(child.tag, str)]
+
+
+def _plist_integer(element):
+    """Convert a plist <integer> element, which may be written in hex."""
+    text = _plist_text(element)
+    if text.startswith(("0x", "0X")):
+        return int(text, 16)
+    return int(text)
+
+
+# Converters for the plist element types that show up in recipes. Any other
+# type (<date>, <data>) makes _plist_load fall back to plistlib, and so does
+# any structure the converters reject.
+_PLIST_CONVERTERS = {
+    "dict": _plist_dict,
+    "array": _plist_array,
+    "string": _plist_text,
+    "integer": _plist_integer,
+    "real": lambda element: float(_plist_text(element)),
+    "true": lambda element: True,
+    "false": lambda element: False,
+}
+
+
+def _plist_value(element):
+    """Convert a plist value element to the matching Python object."""
+    return _PLIST_CONVERTERS[element.tag](element)
+
+
+def _plist_load(f):
+    """Read a plist from the binary file object f, like plistlib.load."""
+    if etree is None:
+        return plistlib.load(f)
+    data = f.read()
+    if not data.startswith(b"bplist00"):
+        try:
+            parser = etree.XMLParser(resolve_entities=False, no_network=True)
+            root = etree.fromstring(data, parser)
+            if root.tag == "plist":
+                return _plist_value(next(iter(root.iterchildren(tag="*"))))
+        except Exception:
+            # Let plistlib handle anything unusual, and report real errors.
+            pass
+    return plistlib.loads(data)
 
-def recipe_from_file(filename):
-    """Create a recipe dictionary from a file. Handle exceptions and log"""
-    if not os.path.isfile(filename):
-        return
 
-    if filename.endswith(".yaml"):
+@lru_cache(maxsize=4096)
+def _parse_recipe_file(path, mtime_ns, size):
+    """Parse the recipe at path. The modification time and size are only part
+    of the cache key, so that a recipe is parsed again once it changes."""
+    if path.endswith(".yaml"):
         try:
             # try to read it as yaml
-            with open(filename, "rb") as f:
-                recipe_dict = yaml.load(f, Loader=yaml.FullLoader)
+            with open(path, "rb") as f:
+                recipe_dict = yaml.load(f, Loader=SafeLoader)
             return recipe_dict
         except Exception as err:
-            log_err(f"WARNING: yaml error for {filename}: {err}")
+            log_err(f"WARNING: yaml error for {path}: {err}")
             return
 
     else:
         try:
             # try to read it as a plist
-            with open(filename, "rb") as f:
-                recipe_dict = plistlib.load(f)
+            with open(path, "rb") as f:
+                recipe_dict = _plist_load(f)
             return recipe_dict
         except Exception as err:
-            log_err(f"WARNING: plist error for {filename}: {err}")
+            log_err(f"WARNING: plist error for {path}: {err}")
             return
 
 
+def recipe_from_file(filename, copy=True):
+    """Create a recipe dictionary from a file. Handle exceptions and log.
+
+    Parsed recipes are cached, so by default a copy is returned that the caller
+    is free to modify. Pass copy=False to get the cached dictionary itself when
+    it will only be read."""
+    try:
+        st = os.stat(filename)
+    except (OSError, ValueError):
+        return
+    if not stat.S_ISREG(st.st_mode):
+        return
+    recipe = _parse_recipe_file(os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+    return deepcopy(recipe) if copy else recipe
+
+
 def get_identifier(recipe):
     """Return identifier from recipe dict. Tries the Identifier
     top-level key and falls back to the legacy key location."""
@@ -376,29 +534,187 @@ def get_identifier(recipe):
 def get_identifier_from_recipe_file(filename):
     """Attempts to read filename and get the
     identifier. Otherwise, returns None."""
-    recipe_dict = recipe_from_file(filename)
+    recipe_dict = recipe_from_file(filename, copy=False)
     return get_identifier(recipe_dict)
 
 
+def normalize_path(path):
+    """Return path with ~ expanded, made absolute."""
+    return os.path.abspath(os.path.expanduser(path))
+
+
+def _visible_entries(directory):
+    """Return the scandir entries of directory that a `*` glob would match."""
+    try:
+        with os.scandir(directory) as it:
+            return [entry for entry in it if not entry.name.startswith(".")]
+    except OSError:
+        return []
+
+
+def _recipe_paths(entries):
+    """Return the paths of the recipe files among entries, grouped by
+    extension in RECIPE_EXTS order."""
+    groups = [[] for _ in RECIPE_EXTS]
+    for entry in entries:
+        for group, ext in zip(groups, RECIPE_EXTS):
+            if entry.name.endswith(ext):
+                group.append(entry.path)
+                break
+    return [path for group in groups for path in group]
+
+
+def iter_recipe_files(directory, subdirs=True, name=None):
+    """Yield the paths of recipe files in directory and, unless subdirs is
+    False, in its immediate subdirectories.
+
+    Top-level recipes come first, and each level is grouped by extension in
+    RECIPE_EXTS order. If name is given, only recipes with that name are
+    yielded; their paths are joined rather than compared against directory
+    listings, so lookups stay case-insensitive where the filesystem is."""
+    if name is None:
+        entries = _visible_entries(directory)
+        yield from _recipe_paths(entries)
+    else:
+        filenames = [f"{name}{ext}" for ext in RECIPE_EXTS]
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path):
+                yield path
+        entries = _visible_entries(directory) if subdirs else []
+    if not subdirs:
+        return
+
+    nested_dirs = [entry.path for entry in entries if entry.is_dir()]
+    if name is None:
+        yield from _recipe_paths(
+            [entry for path in nested_dirs for entry in _visible_entries(path)]
+        )
+    else:
+        for filename in filenames:
+            for nested_dir in nested_dirs:
+                path = os.path.join(nested_dir, filename)
+                if os.path.isfile(path):
+                    yield path
+
+
+# Maps a normalized search directory to the (path, mtime, size) of each recipe
+# file in it when it was indexed, and to its {identifier: path} index.
+_IDENTIFIER_INDEX: Dict[
+    str, Tuple[Tuple[Tuple[str, int, int], ...], Dict[str, str]]
+] = {}
+
+
+def _recipe_file_stats(directory):
+    """Return (path, st_mtime_ns, st_size) for each recipe file in directory,
+    in search order. Adding, removing, renaming or editing a recipe changes
+    the result."""
+    stats = []
+    for path in iter_recipe_files(directory):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stats.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(stats)
+
+
+def _peek_plist_identifier(path):
+    """Return the top-level Identifier string of a plist recipe, reading no
+    further into the file than needed, or None if it can't be found that way."""
+    depth = 0
+    key = None
+    for event, element in ElementTree.iterparse(path, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 2 and element.tag != "dict":
+                return None
+            continue
+        depth -= 1
+        if depth != 2:
+            continue
+        # element is a direct child of the top-level dict
+        if element.tag == "key":
+            key = element.text or ""
+        elif key == "Identifier":
+            if element.tag != "string":
+                return None
+            return element.text or ""
+        else:
+            key = None
+            element.clear()
+    return None
+
+
+def _peek_yaml_identifier(path, max_lines=50):
+    """Return the top-level Identifier string of a YAML recipe from its first
+    lines, or None if it can't be found that way."""
+    with open(path, "rb") as f:
+        for _, line in zip(range(max_lines), f):
+            if line.startswith(b"Identifier:"):
+                value = yaml.load(line, Loader=SafeLoader)["Identifier"]
+                return value if isinstance(value, str) else None
+    return None
+
+
+def _peek_identifier(path):
+    """Return the identifier of the recipe at path, parsing only as much of
+    the file as needed in the common case of a top-level Identifier."""
+    try:
+        if path.endswith(".yaml"):
+            identifier = _peek_yaml_identifier(path)
+        else:
+            identifier = _peek_plist_identifier(path)
+    except Exception:
+        identifier = None
+    if not identifier:
+        # Block scalars and the like peek as empty; read the whole recipe.
+        identifier = get_identifier_from_recipe_file(path)
+    return identifier
+
+
+def _identifier_index(directory):
+    """Return the {identifier: path} index of the recipes in directory,
+    building it if it is missing or out of date."""
+    stats = _recipe_file_stats(directory)
+    cached = _IDENTIFIER_INDEX.get(directory)
+    if cached and cached[0] == stats:
+        return cached[1]
+    index = {}
+    for path, _, _ in stats:
+        identifier = _peek_identifier(path)
+        if identifier:
+            # Keep the first match, as a linear search would.
+            index.setdefault(identifier, path)
+    _IDENTIFIER_INDEX[directory] = (stats, index)
+    return index
+
+
 def find_recipe_by_identifier(identifier, search_dirs):
     """Search search_dirs for a recipe with the given
     identifier"""
     for directory in search_dirs:
-        # TODO: Combine with similar code in get_recipe_list() and find_recipe_by_name()
-        normalized_dir = os.path.abspath(os.path.expanduser(directory))
-        patterns = [os.path.join(normalized_dir, f"*{ext}") for ext in RECIPE_EXTS]
-        patterns.extend(
-            [os.path.join(normalized_dir, f"*/*{ext}") for ext in RECIPE_EXTS]
-        )
-        for pattern in patterns:
-            matches = glob.glob(pattern)
-            for match in matches:
-                if get_identifier_from_recipe_file(match) == identifier:
-                    return match
+        normalized_dir = normalize_path(directory)
+        match = _identifier_index(normalized_dir).get(identifier)
+        if match and get_identifier_from_recipe_file(match) != identifier:
+            # The recipe's header didn't tell the whole story, e.g. it has
+            # duplicate Identifier keys. Search the slow way.
+            _IDENTIFIER_INDEX.pop(normalized_dir, None)
+            match = next(
+                (
+                    path
+                    for path in iter_recipe_files(normalized_dir)
+                    if get_identifier_from_recipe_file(path) == identifier
+                ),
+                None,
+            )
+        if match:
+            return match
 
     return None
 
 
+@lru_cache(maxsize=None)
 def get_autopkg_version():
     """Gets the version number of autopkg"""
     try:
@@ -415,40 +731,90 @@ def get_autopkg_version():
 
 
 def version_equal_or_greater(this, that):
-    """Compares two LooseVersion objects. Returns True if this is
+    """Compares two version strings. Returns True if this is
     equal to or greater than that"""
-    return LooseVersion(this) >= LooseVersion(that)
+    return APLooseVersion(this) >= APLooseVersion(that)
+
+
+@lru_cache(maxsize=4096)
+def _split_keyrefs(text):
+    """Split text around its %KEY% references. Returns a tuple of the literal
+    text chunks and a tuple of the referenced key names; there is always one
+    more literal than there are keys."""
+    parts = RE_KEYREF.split(text)
+    return tuple(parts[0::2]), tuple(parts[1::2])
 
 
 def update_data(a_dict, key, value):
     """Update a_dict keys with value. Existing data can be referenced
     by wrapping the key in %percent% signs."""
 
-    def getdata(match):
-        """Returns data from a match object"""
-        return a_dict[match.group("key")]
+    def getdata(key):
+        """Returns data for key. References to undefined keys are left in place."""
+        if key not in a_dict:
+            log_err(f"Use of undefined key in variable substitution: '{key}'")
+            return f"%{key}%"
+        return a_dict[key]
+
+    def substitute(text):
+        """Do variable substitution for a single string"""
+        if "%" not in text:
+            # Most strings are literals; skip the regex engine entirely
+            return text
+        # The same strings get substituted over and over (recipe arguments, env
+        # values), so reuse the split from earlier calls.
+        literals, keys = _split_keyrefs(text)
+        if not keys:
+            return text
+        parts = [literals[0]]
+        for key_name, literal in zip(keys, literals[1:]):
+            parts.append(getdata(key_name))
+            parts.append(literal)
+        return "".join(parts)
+
+    def replace(frame, index, new_value):
+        """Store new_value at index of the container in frame. Lists are
+        updated in place; a dict is copied the first time one of its values
+        changes, so the original is left untouched."""
+        container = frame[0]
+        if isinstance(container, (dict, NSDictionary)):
+            if frame[2] is None:
+                if isinstance(container, dict):
+                    frame[2] = container.copy()
+                else:
+                    # Need to specify the copy is mutable for NSDictionary
+                    frame[2] = container.mutableCopy()
+            frame[2][index] = new_value
+        else:
+            container[index] = new_value
 
     def do_variable_substitution(item):
-        """Do variable substitution for item"""
-        if isinstance(item, str):
-            try:
-                item = RE_KEYREF.sub(getdata, item)
-            except KeyError as err:
-                log_err(f"Use of undefined key in variable substitution: {err}")
-        elif isinstance(item, (list, NSArray)):
-            for index in range(len(item)):
-                item[index] = do_variable_substitution(item[index])
-        elif isinstance(item, (dict, NSDictionary)):
-            # Modify a copy of the original
-            if isinstance(item, dict):
-                item_copy = item.copy()
-            else:
-                # Need to specify the copy is mutable for NSDictionary
-                item_copy = item.mutableCopy()
-            for key, value in list(item.items()):
-                item_copy[key] = do_variable_substitution(value)
-            return item_copy
-        return item
+        """Do variable substitution for item and everything nested within it.
+        Nested containers are walked with a stack rather than recursion. Each
+        frame holds a container, an iterator over its remaining indexes, its
+        copy once it has one, and its index in the parent container."""
+        root = [item]
+        done = object()
+        stack = [[root, iter(range(1)), None, None]]
+        while stack:
+            frame = stack[-1]
+            index = next(frame[1], done)
+            if index is done:
+                stack.pop()
+                if frame[2] is not None:
+                    # A value inside this dict changed; hand the copy up
+                    replace(stack[-1], frame[3], frame[2])
+                continue
+            element = frame[0][index]
+            if isinstance(element, str):
+                substituted = substitute(element)
+                if substituted is not element:
+                    replace(frame, index, substituted)
+            elif isinstance(element, (list, NSArray)):
+                stack.append([element, iter(range(len(element))), None, index])
+            elif isinstance(element, (dict, NSDictionary)):
+                stack.append([element, iter(element), None, index])
+        return root[0]
 
     a_dict[key] = do_variable_substitution(value)
 
@@ -883,51 +1249,50 @@ class AutoPackager:
             pprint.pprint(self.env)
 
 
-def _cmp(x, y):
-    """
-    Replacement for built-in function cmp that was removed in Python 3
-    Compare the two objects x and y and return an integer according to
-    the outcome. The return value is negative if x < y, zero if x == y
-    and strictly positive if x > y.
-    """
-    return (x > y) - (x < y)
-
-
-class APLooseVersion(LooseVersion):
-    """Subclass of distutils.version.LooseVersion to fix issues under Python 3"""
+class APLooseVersion:
+    """Loose version number, parsed like distutils.version.LooseVersion but
+    with comparisons that work under Python 3"""
 
-    def _pad(self, version_list, max_length):
-        """Pad a version list by adding extra 0 components to the end if needed."""
-        # copy the version_list so we don't modify it
-        cmp_list = list(version_list)
-        while len(cmp_list) < max_length:
-            cmp_list.append(0)
-        return cmp_list
+    def __init__(self, vstring=None):
+        """Init."""
+        self.parse(vstring or "")
+
+    def __str__(self):
+        """String representation."""
+        return self.vstring
+
+    def __repr__(self):
+        """Object representation."""
+        return f"APLooseVersion ('{self}')"
+
+    def parse(self, vstring):
+        """Split vstring into integer and string components, then build the key
+        used for all comparisons."""
+        self.vstring = vstring
+        self.version = [
+            int(component) if component.isdecimal() else component
+            for component in RE_VERSION_COMPONENT.split(vstring)
+            if component and component != "."
+        ]
+        # Trailing zero components don't affect ordering ("1.0" == "1.0.0"),
+        # and tagging each component with a rank sorts integers before strings
+        # so that the resulting tuples can be compared natively.
+        components = list(self.version)
+        while components and components[-1] == 0:
+            components.pop()
+        self._key = tuple(
+            (0, value) if isinstance(value, int) else (1, value) for value in components
+        )
 
     def _compare(self, other):
         """Complete comparison mechanism since LooseVersion's is broken in Python 3."""
-        if not isinstance(other, (LooseVersion, APLooseVersion)):
-            other = APLooseVersion(other)
-        max_length = max(len(self.version), len(other.version))
-        self_cmp_version = self._pad(self.version, max_length)
-        other_cmp_version = self._pad(other.version, max_length)
-        cmp_result = 0
-        for index, value in enumerate(self_cmp_version):
-            try:
-                cmp_result = _cmp(value, other_cmp_version[index])
-            except TypeError:
-                # integer is less than character/string
-                if isinstance(value, int):
-                    return -1
-                return 1
-            else:
-                if cmp_result:
-                    return cmp_result
-        return cmp_result
+        if not isinstance(other, APLooseVersion):
+            other = APLooseVersion(str(other))
+        return (self._key > other._key) - (self._key < other._key)
 
     def __hash__(self):
         """Hash method."""
-        return hash(self.version)
+        return hash(self._key)
 
     def __eq__(self, other):
         """Equals comparison."""
@@ -5,6 +5,8 @@ import json
 import os
 import plistlib
 import unittest
+from io import BytesIO
+from tempfile import TemporaryDirectory
 from textwrap import dedent
 from unittest.mock import mock_open, patch
 
@@ -139,73 +141,66 @@ class TestAutoPkg(unittest.TestCase):
     def tearDown(self):
         pass
 
-    @patch("autopkglib.sys")
-    def test_is_mac_returns_true_on_mac(self, mock_sys):
+    @patch("autopkglib.IS_MAC", True)
+    def test_is_mac_returns_true_on_mac(self):
         """On macOS, is_mac() should return True."""
-        mock_sys.platform = "Darwin-somethingsomething"
         result = autopkglib.is_mac()
         self.assertEqual(result, True)
 
-    @patch("autopkglib.sys")
-    def test_is_mac_returns_false_on_not_mac(self, mock_sys):
+    @patch("autopkglib.IS_MAC", False)
+    def test_is_mac_returns_false_on_not_mac(self):
         """On not-macOS, is_mac() should return False."""
-        mock_sys.platform = "Win32-somethingsomething"
         result = autopkglib.is_mac()
         self.assertEqual(result, False)
 
-    @patch("autopkglib.sys")
-    def test_is_windows_returns_true_on_windows(self, mock_sys):
+    @patch("autopkglib.IS_WINDOWS", True)
+    def test_is_windows_returns_true_on_windows(self):
         """On Windows, is_windows() should return True."""
-        mock_sys.platform = "Win32-somethingsomething"
         result = autopkglib.is_windows()
         self.assertEqual(result, True)
 
-    @patch("autopkglib.sys")
-    def test_is_windows_returns_false_on_not_windows(self, mock_sys):
+    @patch("autopkglib.IS_WINDOWS", False)
+    def test_is_windows_returns_false_on_not_windows(self):
         """On not-Windows, is_windows() should return False."""
-        mock_sys.platform = "Darwin-somethingsomething"
         result = autopkglib.is_windows()
         self.assertEqual(result, False)
 
-    @patch("autopkglib.sys")
-    def test_is_linux_returns_true_on_linux(self, mock_sys):
+    @patch("autopkglib.IS_LINUX", True)
+    def test_is_linux_returns_true_on_linux(self):
         """On Linux, is_linux() should return True."""
-        mock_sys.platform = "Linux-somethingsomething"
         result = autopkglib.is_linux()
         self.assertEqual(result, True)
 
-    @patch("autopkglib.sys")
-    def test_is_linux_returns_false_on_not_linux(self, mock_sys):
+    @patch("autopkglib.IS_LINUX", False)
+    def test_is_linux_returns_false_on_not_linux(self):
         """On not-Linux, is_linux() should return False."""
-        mock_sys.platform = "Win32-somethingsomething"
         result = autopkglib.is_linux()
         self.assertEqual(result, False)
 
-    @patch("autopkglib.sys")
+    @patch("autopkglib.IS_WINDOWS", True)
     @patch("autopkglib.is_executable")
     @patch("autopkglib.os.get_exec_path")
     @patch("autopkglib.os.path")
-    def test_find_binary_windows(self, mock_ospath, mock_getpath, mock_isexe, mock_sys):
+    def test_find_binary_windows(self, mock_ospath, mock_getpath, mock_isexe):
         # Forcibly use ntpath regardless of platform to test "windows" anywhere.
         import ntpath
 
         mock_ospath.join = ntpath.join
-        mock_sys.platform = "Win32"
         mock_getpath.return_value = [r"C:\Windows\system32", r"C:\CurlInstall"]
         mock_isexe.side_effect = [False, True]
         result = autopkglib.find_binary("curl")
         self.assertEqual(result, r"C:\CurlInstall\curl.exe")
 
-    @patch("autopkglib.sys")
+    @patch("autopkglib.IS_WINDOWS", False)
+    @patch("autopkglib.IS_MAC", True)
     @patch("autopkglib.is_executable")
     @patch("autopkglib.os.get_exec_path")
     @patch("autopkglib.os.path")
-    def test_find_binary_posixy(self, mock_ospath, mock_getpath, mock_isexe, mock_sys):
+    def test_find_binary_posixy(self, mock_ospath, mock_getpath, mock_isexe):
         # Forcibly use posixpath regardless of platform to test "linux/mac" anywhere.
         import posixpath
 
         mock_ospath.join = posixpath.join
-        mock_sys.platform = "Darwin"
         mock_getpath.return_value = ["/usr/bin", "/usr/local/bin"]
         mock_isexe.side_effect = [True, False]
         result = autopkglib.find_binary("curl")
@@ -224,20 +219,13 @@ class TestAutoPkg(unittest.TestCase):
         id = autopkglib.get_identifier(recipe)
         self.assertIsNone(id)
 
-    @patch(
-        "builtins.open",
-        new_callable=mock_open,
-        read_data=download_recipe.encode("utf-8"),
-    )
-    @patch("autopkg.plistlib.load")
-    @patch("os.path.isfile")
-    def test_get_identifier_from_recipe_file_returns_identifier(
-        self, mock_isfile, mock_load, mock_file
-    ):
+    def test_get_identifier_from_recipe_file_returns_identifier(self):
         """get_identifier_from_recipe_file should return identifier."""
-        mock_isfile.return_value = True
-        mock_load.return_value = self.download_struct
-        id = autopkglib.get_identifier_from_recipe_file("fake")
+        with TemporaryDirectory() as tmpdir:
+            recipe_path = os.path.join(tmpdir, "GoogleChrome.download.recipe")
+            with open(recipe_path, "w") as f:
+                f.write(self.download_recipe)
+            id = autopkglib.get_identifier_from_recipe_file(recipe_path)
         self.assertEqual(id, "com.github.autopkg.download.googlechrome")
 
     @patch(
@@ -253,6 +241,368 @@ class TestAutoPkg(unittest.TestCase):
         id = autopkglib.get_identifier_from_recipe_file("fake")
         self.assertIsNone(id)
 
+    def test_remove_recipe_extension(self):
+        """remove_recipe_extension should strip exactly one recipe extension."""
+        for name, expected in (
+            ("Firefox.download.recipe", "Firefox.download"),
+            ("Firefox.download.recipe.plist", "Firefox.download"),
+            ("Firefox.download.recipe.yaml", "Firefox.download"),
+            ("Firefox.recipe.recipe", "Firefox.recipe"),
+            ("Firefox.download", "Firefox.download"),
+        ):
+            with self.subTest(name=name):
+                self.assertEqual(autopkglib.remove_recipe_extension(name), expected)
+
+    def test_recipe_from_file_returns_fresh_copy(self):
+        """recipe_from_file should not share recipe dicts between callers."""
+        with TemporaryDirectory() as tmpdir:
+            recipe_path = os.path.join(tmpdir, "GoogleChrome.download.recipe")
+            with open(recipe_path, "w") as f:
+                f.write(self.download_recipe)
+            recipe = autopkglib.recipe_from_file(recipe_path)
+            recipe["Input"]["NAME"] = "Changed"
+            recipe = autopkglib.recipe_from_file(recipe_path)
+        self.assertEqual(recipe["Input"]["NAME"], "GoogleChrome")
+
+    def test_recipe_from_file_rereads_changed_file(self):
+        """recipe_from_file should notice when a recipe file changes."""
+        with TemporaryDirectory() as tmpdir:
+            recipe_path = os.path.join(tmpdir, "GoogleChrome.munki.recipe")
+            with open(recipe_path, "w") as f:
+                f.write(self.download_recipe)
+            autopkglib.recipe_from_file(recipe_path)
+            with open(recipe_path, "w") as f:
+                f.write(self.munki_recipe)
+            self.assertEqual(
+                autopkglib.recipe_from_file(recipe_path), self.munki_struct
+            )
+
+    def assert_plist_load_matches_plistlib(self, data):
+        """_plist_load should return what plistlib returns, or raise likewise."""
+        try:
+            expected = plistlib.loads(data)
+        except Exception as err:
+            with self.assertRaises(type(err)):
+                autopkglib._plist_load(BytesIO(data))
+        else:
+            self.assertEqual(autopkglib._plist_load(BytesIO(data)), expected)
+
+    def test_plist_load_matches_plistlib(self):
+        """_plist_load should read recipes and edge cases exactly like plistlib."""
+        header = b'<?xml version="1.0" encoding="UTF-8"?>\n<plist version="1.0">'
+        bodies = [
+            b"<string>a<!-- c -->b</string>",
+            b"<dict><key>a<!-- c -->b</key><string>x</string></dict>",
+            b"<string>a &amp; b</string>",
+            b"<dict><key>a</key></dict>",
+            b"<dict><string>x</string><string>y</string></dict>",
+            b"<dict><key>a</key><key>b</key></dict>",
+            b"<integer> 0x10</integer>",
+            b"<integer>0x10</integer>",
+            b"<real> 1.5 </real>",
+            b"<dict><key>a</key><true/><!-- c --><key>b</key><array/></dict>",
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                self.assert_plist_load_matches_plistlib(header + body + b"</plist>")
+        for recipe in (self.download_recipe, self.munki_recipe):
+            self.assert_plist_load_matches_plistlib(recipe.encode("utf-8"))
+        with open(
+            os.path.join(os.path.dirname(__file__), "preferences.plist"), "rb"
+        ) as f:
+            self.assert_plist_load_matches_plistlib(f.read())
+
+    @patch("autopkglib.etree", None)
+    def test_plist_load_without_lxml(self):
+        """_plist_load should fall back to plistlib when lxml is missing."""
+        self.assertEqual(
+            autopkglib._plist_load(BytesIO(self.download_recipe.encode("utf-8"))),
+            plistlib.loads(self.download_recipe.encode("utf-8")),
+        )
+
+    def test_iter_recipe_files_orders_top_level_first(self):
+        """iter_recipe_files should list top-level recipes before nested ones."""
+        with TemporaryDirectory() as tmpdir:
+            os.mkdir(os.path.join(tmpdir, "Vendor"))
+            paths = [
+                os.path.join(tmpdir, "Vendor", "App.download.recipe"),
+                os.path.join(tmpdir, "App.munki.recipe.yaml"),
+                os.path.join(tmpdir, "App.pkg.recipe"),
+                os.path.join(tmpdir, "README.md"),
+            ]
+            for path in paths:
+                open(path, "w").close()
+            self.assertEqual(
+                list(autopkglib.iter_recipe_files(tmpdir)),
+                [paths[2], paths[1], paths[0]],
+            )
+            self.assertEqual(
+                list(autopkglib.iter_recipe_files(tmpdir, name="App.download")),
+                [paths[0]],
+            )
+
+    def test_find_recipe_by_identifier_sees_new_recipes(self):
+        """find_recipe_by_identifier should notice recipes added after a search."""
+        with TemporaryDirectory() as tmpdir:
+            os.mkdir(os.path.join(tmpdir, "GoogleChrome"))
+            download_path = os.path.join(tmpdir, "GoogleChrome.download.recipe")
+            with open(download_path, "w") as f:
+                f.write(self.download_recipe)
+            munki_path = os.path.join(
+                tmpdir, "GoogleChrome", "GoogleChrome.munki.recipe"
+            )
+            self.assertEqual(
+                autopkglib.find_recipe_by_identifier(
+                    "com.github.autopkg.download.googlechrome", [tmpdir]
+                ),
+                download_path,
+            )
+            self.assertIsNone(
+                autopkglib.find_recipe_by_identifier(
+                    "com.github.autopkg.munki.google-chrome", [tmpdir]
+                )
+            )
+            with open(munki_path, "w") as f:
+                f.write(self.munki_recipe)
+            self.assertEqual(
+                autopkglib.find_recipe_by_identifier(
+                    "com.github.autopkg.munki.google-chrome", [tmpdir]
+                ),
+                munki_path,
+            )
+
+    def test_find_recipe_by_identifier_sees_edited_recipes(self):
+        """find_recipe_by_identifier should notice recipes edited in place."""
+        with TemporaryDirectory() as tmpdir:
+            recipe_path = os.path.join(tmpdir, "GoogleChrome.recipe")
+            with open(recipe_path, "w") as f:
+                f.write(self.download_recipe)
+            self.assertIsNone(
+                autopkglib.find_recipe_by_identifier(
+                    "com.github.autopkg.munki.google-chrome", [tmpdir]
+                )
+            )
+            with open(recipe_path, "w") as f:
+                f.write(self.munki_recipe)
+            self.assertEqual(
+                autopkglib.find_recipe_by_identifier(
+                    "com.github.autopkg.munki.google-chrome", [tmpdir]
+                ),
+                recipe_path,
+            )
+
+    def test_find_recipe_by_identifier_reads_all_formats(self):
+        """find_recipe_by_identifier should match YAML and legacy identifiers."""
+        with TemporaryDirectory() as tmpdir:
+            yaml_path = os.path.join(tmpdir, "Firefox.download.recipe.yaml")
+            with open(yaml_path, "w") as f:
+                f.write(
+                    "Description: Downloads Firefox.\n"
+                    "Identifier: com.example.download.firefox  # comment\n"
+                    "Input:\n  NAME: Firefox\nProcess: []\n"
+                )
+            folded_path = os.path.join(tmpdir, "Firefox.munki.recipe.yaml")
+            with open(folded_path, "w") as f:
+                f.write(
+                    "Identifier: >-\n  com.example.munki.firefox\n"
+                    "Input:\n  NAME: Firefox\nProcess: []\n"
+                )
+            legacy_path = os.path.join(tmpdir, "Firefox.pkg.recipe")
+            with open(legacy_path, "wb") as f:
+                plistlib.dump(
+                    {"Input": {"IDENTIFIER": "com.example.pkg.firefox"}, "Process": []},
+                    f,
+                )
+            self.assertEqual(
+                autopkglib.find_recipe_by_identifier(
+                    "com.example.download.firefox", [tmpdir]
+                ),
+                yaml_path,
+            )
+            self.assertEqual(
+                autopkglib.find_recipe_by_identifier(
+                    "com.example.pkg.firefox", [tmpdir]
+                ),
+                legacy_path,
+            )
+            self.assertEqual(
+                autopkglib.find_recipe_by_identifier(
+                    "com.example.munki.firefox", [tmpdir]
+                ),
+                folded_path,
+            )
+
+    def test_get_recipe_list_hides_overridden_recipes(self):
+        """get_recipe_list should hide recipes shadowed by a same-named override."""
+        with TemporaryDirectory() as recipe_dir, TemporaryDirectory() as override_dir:
+            with open(
+                os.path.join(recipe_dir, "GoogleChrome.download.recipe"), "w"
+            ) as f:
+                f.write(self.download_recipe)
+            with open(os.path.join(recipe_dir, "GoogleChrome.munki.recipe"), "w") as f:
+                f.write(self.munki_recipe)
+            override = {
+                "Identifier": "local.download.GoogleChrome",
+                "Input": {"NAME": "GoogleChrome"},
+                "ParentRecipe": "com.github.autopkg.download.googlechrome",
+            }
+            override_path = os.path.join(override_dir, "GoogleChrome.download.recipe")
+            with open(override_path, "wb") as f:
+                plistlib.dump(override, f)
+            recipes = autopkg.get_recipe_list(
+                override_dirs=[override_dir],
+                search_dirs=[recipe_dir],
+                augmented_list=True,
+            )
+        self.assertCountEqual(
+            [(recipe["Name"], recipe.get("IsOverride", False)) for recipe in recipes],
+            [("GoogleChrome.munki", False), ("GoogleChrome.download", True)],
+        )
+
+    @patch("autopkg.do_gh_repo_contents_fetch")
+    @patch("autopkg.GitHubSession")
+    def test_get_repository_from_identifier(self, mock_session, mock_fetch):
+        """get_repository_from_identifier should return the first matching repo."""
+        mock_session.return_value.search_for_name.return_value = [
+            {"repository": {"name": "other-recipes"}, "path": "a.recipe.yaml"},
+            {"repository": {"name": "chrome-recipes"}, "path": "b.recipe"},
+            {"repository": {"name": "more-recipes"}, "path": "c.recipe"},
+        ]
+        contents = {
+            "a.recipe.yaml": b"Identifier: com.example.other\n",
+            "b.recipe": self.download_recipe.encode("utf-8"),
+            "c.recipe": self.download_recipe.encode("utf-8"),
+        }
+        mock_fetch.side_effect = lambda repo, path: contents[path]
+        self.assertEqual(
+            autopkg.get_repository_from_identifier(
+                "com.github.autopkg.download.googlechrome"
+            ),
+            "chrome-recipes",
+        )
+
+    @patch("autopkg.log")
+    @patch("autopkg.load_recipe")
+    def test_get_recipe_info_prints_mixed_type_input_keys(self, mock_load, mock_log):
+        """get_recipe_info should print Input whose keys can't be sorted."""
+        mock_load.return_value = {
+            "Identifier": "com.example.mixed",
+            "RECIPE_PATH": "/tmp/mixed.recipe",
+            "Input": {"NAME": {"a": 1, 2: 3}},
+        }
+        self.assertTrue(autopkg.get_recipe_info("mixed", [], []))
+        output = "\n".join(str(call.args[0]) for call in mock_log.call_args_list)
+        self.assertIn("'NAME': {2: 3, 'a': 1}", output)
+
+    def test_recipe_in_override_dir_matches_whole_directories(self):
+        """recipe_in_override_dir should not match sibling directory names."""
+        override_dirs = ["~/RecipeOverrides/"]
+        self.assertTrue(
+            autopkg.recipe_in_override_dir("~/RecipeOverrides/x.recipe", override_dirs)
+        )
+        self.assertFalse(
+            autopkg.recipe_in_override_dir("~/RecipeOverrides2/x.recipe", override_dirs)
+        )
+
+    def test_path_in_dirs_follows_working_directory(self):
+        """path_in_dirs should resolve relative dirs against the current cwd."""
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        with TemporaryDirectory() as first, TemporaryDirectory() as second:
+            recipe_path = os.path.join(second, "x.recipe")
+            os.chdir(first)
+            self.assertFalse(autopkg.path_in_dirs(recipe_path, ["."]))
+            os.chdir(second)
+            self.assertTrue(autopkg.path_in_dirs(recipe_path, ["."]))
+
+    def test_normalize_path_follows_working_directory(self):
+        """normalize_path should resolve relative paths against the current cwd."""
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        with TemporaryDirectory() as first, TemporaryDirectory() as second:
+            os.chdir(first)
+            first_path = autopkglib.normalize_path("Recipes")
+            os.chdir(second)
+            second_path = autopkglib.normalize_path("Recipes")
+        self.assertNotEqual(first_path, second_path)
+        self.assertEqual(os.path.basename(second_path), "Recipes")
+
+    def test_update_data_substitutes_nested_values(self):
+        """update_data should substitute strings at any depth."""
+        env = {"NAME": "GoogleChrome", "VERSION": "1.0"}
+        value = {
+            "name": "%NAME%",
+            "items": ["%NAME%-%VERSION%.dmg", {"version": "%VERSION%"}],
+        }
+        autopkglib.update_data(env, "pkginfo", value)
+        self.assertEqual(
+            env["pkginfo"],
+            {
+                "name": "GoogleChrome",
+                "items": ["GoogleChrome-1.0.dmg", {"version": "1.0"}],
+            },
+        )
+
+    def test_update_data_does_not_modify_original_dict(self):
+        """update_data should substitute into a copy of a dict value."""
+        env = {"NAME": "GoogleChrome"}
+        value = {"name": "%NAME%"}
+        autopkglib.update_data(env, "pkginfo", value)
+        self.assertEqual(env["pkginfo"], {"name": "GoogleChrome"})
+        self.assertEqual(value, {"name": "%NAME%"})
+
+    def test_update_data_copies_only_changed_dicts(self):
+        """update_data should copy a dict only when a value inside it changes."""
+        env = {"NAME": "GoogleChrome"}
+        unchanged = {"type": "dmg"}
+        nested = {"name": "%NAME%"}
+        value = {"installer": unchanged, "info": {"nested": nested}}
+        autopkglib.update_data(env, "pkginfo", value)
+        self.assertEqual(env["pkginfo"]["info"], {"nested": {"name": "GoogleChrome"}})
+        self.assertIs(env["pkginfo"]["installer"], unchanged)
+        self.assertEqual(value["info"], {"nested": {"name": "%NAME%"}})
+
+    def test_update_data_keeps_dicts_without_substitutions(self):
+        """update_data should not copy a dict with nothing to substitute."""
+        env = {"NAME": "GoogleChrome"}
+        value = {"name": "GoogleChrome", "sizes": {"min": "1"}}
+        autopkglib.update_data(env, "pkginfo", value)
+        self.assertIs(env["pkginfo"], value)
+
+    def test_update_data_leaves_undefined_keys(self):
+        """update_data should leave strings with undefined keys untouched."""
+        env = {}
+        autopkglib.update_data(env, "url", "https://%HOST%/path")
+        self.assertEqual(env["url"], "https://%HOST%/path")
+
+    def test_update_data_substitutes_around_undefined_keys(self):
+        """update_data should still substitute defined keys next to undefined ones."""
+        env = {"NAME": "GoogleChrome"}
+        autopkglib.update_data(env, "filename", "%UNDEFINED%-%NAME%.dmg")
+        self.assertEqual(env["filename"], "%UNDEFINED%-GoogleChrome.dmg")
+
+    def test_aplooseversion_ignores_trailing_zeros(self):
+        """APLooseVersion should treat missing components as zero."""
+        self.assertEqual(autopkglib.APLooseVersion("1.0"), "1.0.0")
+        self.assertEqual(
+            hash(autopkglib.APLooseVersion("1.0")),
+            hash(autopkglib.APLooseVersion("1")),
+        )
+        self.assertLess(autopkglib.APLooseVersion("1.0"), "1.0.1")
+
+    def test_aplooseversion_sorts_numbers_before_strings(self):
+        """APLooseVersion should order numeric components before strings."""
+        self.assertLess(autopkglib.APLooseVersion("1.0.1"), "1.0.b")
+        self.assertLess(autopkglib.APLooseVersion("1.0b1"), "1.0b2")
+        self.assertGreater(autopkglib.APLooseVersion("1.10"), "1.9")
+
+    def test_version_equal_or_greater(self):
+        """version_equal_or_greater should compare loose version strings."""
+        self.assertTrue(autopkglib.version_equal_or_greater("2.3.0", "2.3"))
+        self.assertTrue(autopkglib.version_equal_or_greater("2.10", "2.9.1"))
+        self.assertTrue(autopkglib.version_equal_or_greater("1.0b1", "1.0.1"))
+        self.assertFalse(autopkglib.version_equal_or_greater("1.0", "1.0.1"))
+
 
 if __name__ == "__main__":
     unittest.main()
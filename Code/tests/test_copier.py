@@ -45,7 +45,7 @@ class TestCopier(unittest.TestCase):
         with self.assertRaises(ProcessorError):
             self.processor.main()
 
-    @patch("autopkglib.glob.glob")
+    @patch("glob.glob")
     @patch("autopkglib.Copier.copy")
     def test_no_fail_if_good_env(self, mock_copy, mock_glob):
         """The processor should not raise any exceptions if run normally."""
@@ -55,7 +55,7 @@ class TestCopier(unittest.TestCase):
         self.processor.main()
         mock_copy.assert_called_once()
 
-    @patch("autopkglib.glob.glob")
+    @patch("glob.glob")
     @patch("autopkglib.Copier.copy")
     def test_no_fail_if_glob_env(self, mock_copy, mock_glob):
         """The processor should not raise any exceptions if run with a glob."""
@@ -67,7 +67,7 @@ class TestCopier(unittest.TestCase):
 
     @patch("autopkglib.Copier.unmount")
     @patch("autopkglib.Copier.mount")
-    @patch("autopkglib.glob.glob")
+    @patch("glob.glob")
     @patch("autopkglib.Copier.copy")
     def test_no_fail_if_dmg_env(self, mock_copy, mock_glob, mock_mount, mock_unmount):
         """The processor should not raise any exceptions if run with a DMG."""
@@ -81,7 +81,7 @@ class TestCopier(unittest.TestCase):
 
     @patch("autopkglib.Copier.unmount")
     @patch("autopkglib.Copier.mount")
-    @patch("autopkglib.glob.glob")
+    @patch("glob.glob")
     @patch("autopkglib.Copier.copy")
     def test_no_fail_if_dmg_glob_env(
         self, mock_copy, mock_glob, mock_mount, mock_unmount
@@ -95,7 +95,7 @@ class TestCopier(unittest.TestCase):
         mock_copy.assert_called_once()
         mock_unmount.assert_called_once()
 
-    @patch("autopkglib.glob.glob")
+    @patch("glob.glob")
     @patch("autopkglib.Copier.copy")
     def test_multiple_matches(self, mock_copy, mock_glob):
         """The processor should not raise any exceptions if run with a glob."""
@@ -23,7 +23,7 @@ class TestPkgCopier(unittest.TestCase):
         pass
 
     @patch("autopkglib.PkgCopier.copy")
-    @patch("autopkglib.glob.glob")
+    @patch("glob.glob")
     def test_no_fail_if_good_env(self, mock_glob, mock_copy):
         """The processor should not raise any exceptions if run normally."""
         self.processor.env = self.good_env
@@ -31,7 +31,7 @@ class TestPkgCopier(unittest.TestCase):
         self.processor.main()
 
     @patch("autopkglib.PkgCopier.copy")
-    @patch("autopkglib.glob.glob")
+    @patch("glob.glob")
     def test_no_pkgpath_uses_source_name(self, mock_glob, mock_copy):
         """If pkg_path is not specified, it should use the source name."""
         self.processor.env = self.good_glob_env
@@ -45,7 +45,7 @@ class TestPkgCopier(unittest.TestCase):
         )
 
     @patch("autopkglib.PkgCopier.copy")
-    @patch("autopkglib.glob.glob")
+    @patch("glob.glob")
     def test_no_pkgpath_uses_dest_name(self, mock_glob, mock_copy):
         """If pkg_path is specified, it should be used."""
         self.processor.env = self.good_glob_dest_env
@@ -1,6 +1,7 @@
 #!/usr/local/autopkg/python
 
 import json
+import os
 import plistlib
 import unittest
 from io import BytesIO
@@ -45,9 +46,8 @@ class TestPreferences(unittest.TestCase):
 
     def setUp(self):
         self._workdir = TemporaryDirectory()
-        self.mock_platform = patch("autopkglib.sys.platform").start()
         # Force loading to go through the file-backed path by default.
-        self.mock_platform.return_value = "__HighlyUnlikely-Platform-Name__"
+        self.patch_platform("__HighlyUnlikely-Platform-Name__").start()
 
         # Mock all of these for all tests to help ensure we do not accidentally
         # use the real macOS preference store.
@@ -61,9 +61,10 @@ class TestPreferences(unittest.TestCase):
             "autopkglib.CFPreferencesAppSynchronize"
         ).start()
 
-        self.mock_appdirs = patch("autopkglib.appdirs").start()
         # Ensure we don't accidentally load real config and muck up tests.
-        self.mock_appdirs.user_config_dir.return_value = self._workdir.name
+        self.config_plist = os.path.join(self._workdir.name, "config.plist")
+        self.config_json = os.path.join(self._workdir.name, "config.json")
+        patch("autopkglib.CONFIG_FILES", (self.config_plist, self.config_json)).start()
 
         self.addCleanup(patch.stopall)
         self.addCleanup(self._workdir.cleanup)
@@ -71,13 +72,21 @@ class TestPreferences(unittest.TestCase):
     def tearDown(self):
         pass
 
+    def patch_platform(self, platform: str) -> mock._patch:
+        """Patches the cached platform checks to match `platform`."""
+        return patch.multiple(
+            "autopkglib",
+            IS_MAC=platform == "Darwin",
+            IS_WINDOWS=platform == "Windows",
+            IS_LINUX=platform == "Linux",
+        )
+
     def test_new_prefs_object_is_empty(self):
         """A new Preferences object should be empty with no config."""
         test_platforms = ["Darwin"]
         test_platforms += self.PRIMARY_NON_MACOS_PLATFORMS
         for platform in test_platforms:
-            with self.subTest(platform=platform):
-                self.mock_platform.return_value = platform
+            with self.subTest(platform=platform), self.patch_platform(platform):
                 fake_prefs = Preferences()
                 self.assertEqual(fake_prefs.file_path, None)
                 self.assertEqual(fake_prefs.type, None)
@@ -90,6 +99,26 @@ class TestPreferences(unittest.TestCase):
         value = fake_prefs._get_macos_pref("fake")
         self.assertEqual(value, "FakeValue")
 
+    def test_get_macos_pref_converts_nested_values(self):
+        """get_macos_pref should convert nested containers to Python types."""
+        self.mock_copyappvalue.return_value = {
+            "/path/to/repo": {"URL": "fake_url", "dirs": ["a", "b"]}
+        }
+        fake_prefs = Preferences()
+        value = fake_prefs._get_macos_pref("RECIPE_REPOS")
+        self.assertEqual(
+            value, {"/path/to/repo": {"URL": "fake_url", "dirs": ["a", "b"]}}
+        )
+
+    def test_get_macos_prefs_reads_each_key_once(self):
+        """Keys set in both the user and system domains should be read once."""
+        self.mock_copykeylist.side_effect = lambda *_, **_kw: ["CACHE_DIR"]
+        self.mock_copyappvalue.return_value = "/path/to/cache"
+        with self.patch_platform("Darwin"):
+            fake_prefs = Preferences()
+        self.assertEqual(fake_prefs.get_all_prefs(), {"CACHE_DIR": "/path/to/cache"})
+        self.mock_copyappvalue.assert_called_once()
+
     def test_parse_file_is_empty_by_default(self):
         """Parsing a non-existent file should return an empty dict."""
         fake_prefs = Preferences()
@@ -119,6 +148,16 @@ class TestPreferences(unittest.TestCase):
         self.assertEqual(value, plistlib.loads(TEST_PLIST_PREFS))
         self.assertEqual(fake_prefs.type, "plist")
 
+    def test_get_pref_returns_copy_of_containers(self):
+        """get_pref should not expose mutable values stored in prefs."""
+        fake_prefs = Preferences()
+        fake_prefs.prefs = {"RECIPE_REPOS": {"/path": {"URL": "fake_url"}}}
+        value = fake_prefs.get_pref("RECIPE_REPOS")
+        value["/path"]["URL"] = "changed"
+        self.assertEqual(
+            fake_prefs.get_pref("RECIPE_REPOS"), {"/path": {"URL": "fake_url"}}
+        )
+
     @patch.object(Preferences, "write_file")
     @patch.object(Preferences, "_set_macos_pref")
     def test_set_pref_no_file(self, mock_write_file, mock_set_macos_pref):
@@ -130,25 +169,29 @@ class TestPreferences(unittest.TestCase):
         value = fake_prefs.get_pref("TEST_KEY")
         self.assertEqual(value, "fake_value")
 
-    @patch_open(TEST_JSON_PREFS)
-    def test_init_prefs_files(self, _mock_open):
+    def test_init_prefs_files(self):
         """Preferences should load file-backed config on primary platforms."""
+        with open(self.config_json, "wb") as f:
+            f.write(TEST_JSON_PREFS)
         for actual_platform in self.PRIMARY_NON_MACOS_PLATFORMS:
-            with self.subTest(platform=actual_platform):
-                self.mock_platform.return_value = actual_platform
+            with self.subTest(platform=actual_platform), self.patch_platform(
+                actual_platform
+            ):
                 prefs = Preferences()
                 self.assertNotEqual(prefs.file_path, None)
                 value = prefs.get_all_prefs()
                 self.assertEqual(value, json.loads(TEST_JSON_PREFS))
                 self.assertEqual(prefs.type, "json")
 
-    @patch_open(b"{}")
     @patch.object(Preferences, "write_file")
-    def test_set_pref_files(self, mock_write_file, mock_open):
+    def test_set_pref_files(self, mock_write_file):
         """Preferences().set_pref should write file on file-backed config platforms"""
+        with open(self.config_json, "wb") as f:
+            f.write(b"{}")
         for actual_platform in self.PRIMARY_NON_MACOS_PLATFORMS:
-            with self.subTest(platform=actual_platform):
-                self.mock_platform.return_value = actual_platform
+            with self.subTest(platform=actual_platform), self.patch_platform(
+                actual_platform
+            ):
                 fake_prefs = Preferences()
                 self.assertNotEqual(fake_prefs.file_path, None)
                 fake_prefs.set_pref("TEST_KEY", "fake_value")
@@ -160,9 +203,9 @@ class TestPreferences(unittest.TestCase):
     @patch.object(Preferences, "_set_macos_pref")
     def test_set_pref_mac(self, mock_set_macos_pref):
         """Preferences().set_pref should write macOS preference store on macOS."""
-        self.mock_platform.lower.return_value = "darwin"
-        fake_prefs = Preferences()
-        fake_prefs.set_pref("TEST_KEY", "fake_value")
+        with self.patch_platform("Darwin"):
+            fake_prefs = Preferences()
+            fake_prefs.set_pref("TEST_KEY", "fake_value")
         value = fake_prefs.get_pref("TEST_KEY")
         self.assertEqual(value, "fake_value")
         mock_set_macos_pref.assert_called()
@@ -172,12 +215,64 @@ class TestPreferences(unittest.TestCase):
     @patch_open(TEST_JSON_PREFS)
     def test_set_pref_mac_files(self, mock_open, mock_write_file, mock_set_macos_pref):
         """Preferences().set_pref should write file on macOS and read_file() used."""
-        self.mock_platform.return_value = "darwin"
-        fake_prefs = Preferences()
-        fake_prefs.read_file("fake_config_file")
-        mock_open.assert_called()
-        fake_prefs.set_pref("TEST_KEY", "fake_value")
+        with self.patch_platform("Darwin"):
+            fake_prefs = Preferences()
+            fake_prefs.read_file("fake_config_file")
+            mock_open.assert_called()
+            fake_prefs.set_pref("TEST_KEY", "fake_value")
         mock_write_file.assert_called()
         mock_set_macos_pref.assert_not_called()
         value = fake_prefs.get_pref("TEST_KEY")
         self.assertEqual(value, "fake_value")
+
+    def test_read_file_accepts_json_with_bom(self):
+        """A JSON prefs file with a UTF-8 byte-order mark should still load."""
+        with open(self.config_json, "wb") as f:
+            f.write(b"\xef\xbb\xbf" + TEST_JSON_PREFS)
+        fake_prefs = Preferences()
+        fake_prefs.read_file(self.config_json)
+        self.assertEqual(fake_prefs.get_all_prefs(), json.loads(TEST_JSON_PREFS))
+        self.assertEqual(fake_prefs.type, "json")
+
+    def test_read_file_matches_json_module(self):
+        """JSON prefs should read exactly as the json module reads them."""
+        raw = b'{"BIG": 123456789012345678901234567890, "NOT_A_NUMBER": NaN}'
+        with open(self.config_json, "wb") as f:
+            f.write(raw)
+        fake_prefs = Preferences()
+        fake_prefs.read_file(self.config_json)
+        value = fake_prefs.get_all_prefs()
+        self.assertEqual(value["BIG"], 123456789012345678901234567890)
+        self.assertNotEqual(value["NOT_A_NUMBER"], value["NOT_A_NUMBER"])
+
+    def test_write_json_file_matches_json_module(self):
+        """JSON prefs should be written with the json module's layout."""
+        with open(self.config_json, "wb") as f:
+            f.write(TEST_JSON_PREFS)
+        fake_prefs = Preferences()
+        fake_prefs.read_file(self.config_json)
+        fake_prefs.set_pref("NAME", "Caf\u00e9")
+        with open(self.config_json, "rb") as f:
+            value = f.read()
+        self.assertEqual(
+            value,
+            json.dumps(
+                {"CACHE_DIR": "/path/to/cache", "NAME": "Caf\u00e9"},
+                indent=2,
+                sort_keys=True,
+            ).encode("utf-8"),
+        )
+
+    def test_write_json_file_round_trips(self):
+        """Preferences written as JSON should read back unchanged."""
+        with open(self.config_json, "wb") as f:
+            f.write(TEST_JSON_PREFS)
+        fake_prefs = Preferences()
+        fake_prefs.read_file(self.config_json)
+        fake_prefs.set_pref("RECIPE_SEARCH_DIRS", [".", "~/Recipes"])
+        with open(self.config_json, "rb") as f:
+            value = json.load(f)
+        self.assertEqual(
+            value,
+            {"CACHE_DIR": "/path/to/cache", "RECIPE_SEARCH_DIRS": [".", "~/Recipes"]},
+        )